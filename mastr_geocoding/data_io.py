@@ -1,12 +1,16 @@
 from __future__ import annotations
 
+import hashlib
+import os
 import zipfile
 
-from pathlib import Path
-from urllib.request import urlretrieve
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path, PurePosixPath
 
 import numpy as np
 import pandas as pd
+import requests
 
 from loguru import logger
 
@@ -17,6 +21,14 @@ MASTR_DATA_DIR = (
     / "bnetza_mastr"
     / f"dump_{settings['mastr-data'].dump_date}"
 )
+# bump whenever the parsing of the MaStR CSVs changes to invalidate cached results
+CACHE_VERSION = 1
+MASTR_DTYPES = {
+    "Postleitzahl": "string[pyarrow]",
+    "Gemeinde": "string[pyarrow]",
+    "Bundesland": "category",
+    "Standort": "string[pyarrow]",
+}
 
 
 def geocoding_data(
@@ -41,74 +53,109 @@ def geocoding_data(
     )
 
 
-def isfloat(num: str):
+def zip_and_municipality_from_csv(
+    tech: str,
+    data_dir: Path,
+    f_name: str,
+    federal_state: str | None,
+) -> list[pd.Series]:
     """
-    Determine if string can be converted to float.
+    Get unique combinations of ZIP code and municipality from a single MaStR CSV.
 
     Parameters
     -----------
-    num : str
-        String to parse.
+    tech : str
+        Technology as used in the MaStR file name.
+    data_dir : pathlib.Path
+        Directory containing the extracted MaStR CSVs.
+    f_name : str
+        File name template of the MaStR CSVs.
+    federal_state : str or None
+        Federal state to restrict the data to. No filter is applied if None.
     Returns
     -------
-    bool
-        Returns True in string can be parsed to float.
+    list of pandas.Series
+        Unique combinations of zip code and municipality taken from the ZIP code and
+        municipality columns and, where available, parsed from the Standort column.
     """
-    try:
-        float(num)
-        return True
-    except ValueError:
-        return False
+    cols = ["Postleitzahl", "Gemeinde"] + (["Bundesland"] if federal_state else [])
 
+    if tech == "solar":
+        cols += ["Standort"]
 
-def zip_and_municipality_from_standort(
-    standort: str,
-) -> tuple[str, bool]:
-    """
-    Get zip code and municipality from Standort string split into a list.
+    file = f_name.format(tech)
 
-    Parameters
-    -----------
-    standort : str
-        Standort as given from MaStR data.
-    Returns
-    -------
-    str
-        Standort with only the zip code and municipality
-        as well a ', Germany' added.
-    """
-    standort_list = standort.split()
+    df = pd.read_csv(
+        data_dir / file,
+        usecols=cols,
+        dtype={col: MASTR_DTYPES[col] for col in cols},
+        engine="pyarrow",
+        dtype_backend="pyarrow",
+    )
+
+    logger.debug(f"Read {data_dir / file}.")
+
+    if federal_state:
+        logger.debug(f"Only using data for federal state {federal_state}.")
+        df = df.loc[df.Bundesland == federal_state]
 
-    found = False
-    count = 0
+    # cleaning plz
+    zips = df.Postleitzahl.str.extract(r"^\s*(\d{1,5})(?:\.0*)?\s*$", expand=False)
+    # the pyarrow engine may read empty fields as "" instead of NA
+    mask = zips.notna() & df.Gemeinde.str.strip().str.len().gt(0).fillna(False)
+    ok_df = df.loc[mask]
 
-    for count, elem in enumerate(standort_list):
-        if len(elem) != 5:
-            continue
-        if not elem.isnumeric():
-            continue
+    logger.info(
+        f"{len(ok_df)} of {len(df)} values within {file} have correct values for "
+        f"ZIP code and municipality."
+    )
+
+    # keep everything Arrow-backed so that string concatenation runs in
+    # pyarrow's binary_join_element_wise kernel
+    ok_zips = zips[mask].str.zfill(5)
 
-        found = True
+    res_lst = [
+        (ok_zips + " " + ok_df.Gemeinde.str.strip() + ", Deutschland").drop_duplicates()
+    ]
 
-        break
+    # get zip and municipality from Standort
+    parse_df = df.loc[~mask]
 
-    if found:
-        cleaned_str = " ".join(standort_list[count:])
+    if parse_df.empty or "Standort" not in parse_df.columns:
+        return res_lst
 
-        return cleaned_str, found
+    init_len = len(parse_df)
 
-    logger.warning(
-        "Couldn't identify zip code. This entry will be dropped."
-        f" Original standort: {standort}."
+    logger.info(
+        f"Parsing ZIP code and municipality from Standort for {init_len} values "
+        f"for {file}."
     )
 
-    return standort, found
+    extracted = parse_df.Standort.str.extract(
+        r"(?P<zip_and_municipality>(?<!\S)\d{5}(?!\S).*)$", expand=True
+    )["zip_and_municipality"]
+    parsed = extracted.dropna().str.replace(r"\s+", " ", regex=True).str.strip()
+    failed = parse_df.Standort.loc[extracted.isna()]
+
+    if not failed.empty:
+        logger.warning(
+            f"Couldn't identify zip code for {len(failed)} values within {file}. "
+            f"These entries will be dropped. Sample: {failed.head().tolist()}."
+        )
+
+    logger.info(f"Successfully parsed {len(parsed)} of {init_len} values for {file}.")
+
+    res_lst.append((parsed + ", Deutschland").drop_duplicates())
+
+    return res_lst
 
 
 def get_zip_and_municipality() -> pd.DataFrame:
     """
     Setup DataFrame to geocode.
 
+    The MaStR CSVs of the different technologies are processed in parallel.
+
     Returns
     -------
     pandas.DataFrame
@@ -117,93 +164,68 @@ def get_zip_and_municipality() -> pd.DataFrame:
     """
     mastr_data = settings["mastr-data"]
     f_name = mastr_data.f_name
-    technologies = mastr_data.technologies
-    federal_state = mastr_data.federal_state
+    technologies = tuple(mastr_data.technologies)
+    federal_state = mastr_data.federal_state or None
     dump_date = mastr_data.dump_date
     zip_name = mastr_data.zip_name.format(dump_date).split(".")[0]
     data_dir = MASTR_DATA_DIR / zip_name
 
-    res_lst = []
-
-    logger.info(f"Reading MaStR data from {data_dir} ...")
-
-    federal_states = set()
-
-    base_cols = ["Postleitzahl", "Gemeinde", "Bundesland", "Land"]
-    extra = ["Standort"]
-
-    for tech in technologies:
-        if tech == "solar":
-            cols = base_cols + extra
-        else:
-            cols = base_cols
-
-        file = f_name.format(tech)
-
-        df = pd.read_csv(
-            data_dir / file,
-            usecols=cols,
-            low_memory=False,
-        )
-
-        logger.debug(f"Read {data_dir / file}.")
-
-        federal_states = federal_states.union(set(df.Bundesland.unique()))
-
-        if federal_state in federal_states:
-            logger.debug(f"Only using data for federal state {federal_state}.")
-            df = df.loc[df.Bundesland == federal_state]
-
-        # cleaning plz
-        mask = (
-            df.Postleitzahl.apply(isfloat)
-            & ~df.Postleitzahl.isna()
-            & ~df.Gemeinde.isna()
-        )
-        ok_df = df.loc[mask]
-
-        logger.info(
-            f"{len(ok_df)} of {len(df)} values within {file} have correct values for "
-            f"ZIP code and municipality."
-        )
-
-        res_lst.append(
-            ok_df.Postleitzahl.astype(int).astype(str).str.zfill(5)
-            + " "
-            + ok_df.Gemeinde.astype(str).str.rstrip().str.lstrip()
-            + ", Deutschland"
+    csv_stats = tuple(
+        (stat.st_size, stat.st_mtime_ns)
+        for stat in ((data_dir / f_name.format(tech)).stat() for tech in technologies)
+    )
+    cache_key = hashlib.sha1(
+        repr(
+            (CACHE_VERSION, dump_date, f_name, technologies, federal_state, csv_stats)
+        ).encode()
+    ).hexdigest()[:10]
+    cache_path = MASTR_DATA_DIR / f"zip_and_municipality_{cache_key}.parquet"
+
+    if cache_path.exists():
+        logger.info(f"Reading cached ZIP codes and municipalities from {cache_path}.")
+
+        return geocoding_data(
+            pd.read_parquet(cache_path)["zip_and_municipality"].to_numpy()
         )
 
-        # get zip and municipality from Standort
-        parse_df = df.loc[~mask]
-
-        if parse_df.empty or "Standort" not in parse_df.columns:
-            continue
+    logger.info(f"Reading MaStR data from {data_dir} ...")
 
-        init_len = len(parse_df)
+    with ProcessPoolExecutor(
+        max_workers=min(len(technologies), os.cpu_count() or 1)
+    ) as executor:
+        res_lst = [
+            ser
+            for tech_lst in executor.map(
+                partial(
+                    zip_and_municipality_from_csv,
+                    data_dir=data_dir,
+                    f_name=f_name,
+                    federal_state=federal_state,
+                ),
+                technologies,
+            )
+            for ser in tech_lst
+        ]
 
-        logger.info(
-            f"Parsing ZIP code and municipality from Standort for {init_len} values "
-            f"for {file}."
-        )
+    geocoding_df = geocoding_data(
+        pd.unique(np.concatenate([ser.to_numpy(copy=False) for ser in res_lst]))
+    )
 
-        parsed_df = pd.DataFrame(
-            parse_df.Standort.astype(str)
-            .apply(zip_and_municipality_from_standort)
-            .tolist(),
-            index=parse_df.index,
-            columns=["zip_and_municipality", "drop_this"],
+    if federal_state and geocoding_df.empty:
+        raise ValueError(
+            f"No MaStR data found for federal state '{federal_state}'. Set "
+            "federal_state to a value of the Bundesland column or leave it empty to "
+            "use the data of all federal states."
         )
 
-        parsed_df = parsed_df.loc[parsed_df.drop_this]
-
-        logger.info(
-            f"Successfully parsed {len(parsed_df)} of {init_len} values for {file}."
-        )
+    if not geocoding_df.empty:
+        for stale_path in MASTR_DATA_DIR.glob("zip_and_municipality_*.parquet"):
+            stale_path.unlink()
 
-        res_lst.append(parsed_df["zip_and_municipality"] + ", Deutschland")
+        geocoding_df.to_parquet(cache_path, compression="zstd", index=False)
+        logger.info(f"Cached ZIP codes and municipalities to {cache_path}.")
 
-    return geocoding_data(pd.concat(res_lst, ignore_index=True).unique())
+    return geocoding_df
 
 
 def download_mastr_data():
@@ -218,34 +240,60 @@ def download_mastr_data():
     dump_date = mastr_data.dump_date
     zip_name = mastr_data.zip_name.format(dump_date)
     zip_path = MASTR_DATA_DIR / zip_name
+    f_name = mastr_data.f_name
+    needed_files = {f_name.format(tech) for tech in mastr_data.technologies}
 
     # Download ZIP if not already present
     if zip_path.exists():
         logger.info(f"ZIP file already exists at {zip_path}, skipping download.")
     else:
         logger.info(f"Downloading ZIP from {zenodo_files_url + zip_name} ...")
-        urlretrieve(zenodo_files_url + zip_name, zip_path)
+        part_path = zip_path.with_suffix(".part")
+
+        with requests.get(
+            zenodo_files_url + zip_name, stream=True, timeout=(10, 60)
+        ) as response:
+            response.raise_for_status()
+
+            with open(part_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=4 * 1024 * 1024):
+                    f.write(chunk)
+
+        part_path.rename(zip_path)
         logger.info(f"Download complete: {zip_path}")
 
-    # Check if all extracted files already exist
+    # Check if all needed files are already extracted
     with zipfile.ZipFile(zip_path, "r") as zip_ref:
-        members = zip_ref.namelist()
-        missing_files = []
+        members = [
+            member
+            for member in zip_ref.namelist()
+            if PurePosixPath(member).name in needed_files
+        ]
+        not_in_zip = needed_files - {PurePosixPath(member).name for member in members}
+
+        if not_in_zip:
+            raise FileNotFoundError(
+                f"{sorted(not_in_zip)} not found in {zip_path}. Check the settings "
+                "f_name and technologies."
+            )
 
-        for member in members:
-            # Überspringe Verzeichnisse
-            if member.endswith("/"):
-                continue
-            target_path = MASTR_DATA_DIR / member
-            if not target_path.exists():
-                missing_files.append(member)
+        member_dirs = {
+            MASTR_DATA_DIR / PurePosixPath(member).parent for member in members
+        }
+        existing_files = {
+            path.relative_to(MASTR_DATA_DIR).as_posix()
+            for member_dir in member_dirs
+            if member_dir.is_dir()
+            for path in member_dir.iterdir()
+        }
+        missing_files = [member for member in members if member not in existing_files]
 
         if not missing_files:
-            logger.info("All ZIP contents already extracted, skipping extraction.")
+            logger.info("All needed files already extracted, skipping extraction.")
         else:
             logger.info(
-                f"{len(missing_files)} files missing, extracting ZIP to "
+                f"{len(missing_files)} files missing, extracting them to "
                 f"{MASTR_DATA_DIR} ..."
             )
-            zip_ref.extractall(MASTR_DATA_DIR)
+            zip_ref.extractall(MASTR_DATA_DIR, members=missing_files)
             logger.info("Extraction complete.")
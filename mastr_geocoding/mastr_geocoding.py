@@ -1,7 +1,16 @@
 from __future__ import annotations
 
+import sqlite3
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
 
 from geopy.extra.rate_limiter import RateLimiter
 from geopy.geocoders import Nominatim
@@ -108,64 +117,199 @@ def safe_geocode(text: str, ratelimiter: RateLimiter) -> tuple:
         return None, "exception"
 
 
+def geocode_cache(path: Path) -> sqlite3.Connection:
+    """
+    Open the SQLite cache of geocoding results, creating it if necessary.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        Path to the SQLite database file.
+
+    Returns
+    -------
+    sqlite3.Connection
+        Connection to the cache. It may be shared between threads as long as
+        writes are serialized by the caller.
+    """
+    cache = sqlite3.connect(path, check_same_thread=False)
+    cache.execute("PRAGMA journal_mode=WAL")
+    cache.execute("PRAGMA synchronous=NORMAL")
+    cache.execute(
+        "CREATE TABLE IF NOT EXISTS cache "
+        "(key TEXT PRIMARY KEY, lat REAL, lon REAL, alt REAL, source TEXT)"
+    )
+
+    return cache
+
+
+def import_legacy_cache(cache: sqlite3.Connection, csv_path: Path) -> None:
+    """
+    Import successful results of the former CSV cache into an empty SQLite cache.
+
+    Parameters
+    ----------
+    cache : sqlite3.Connection
+        Connection to the geocoding cache as returned by `geocode_cache`.
+    csv_path : pathlib.Path
+        Path to the former CSV cache `geocode_results.csv`.
+    """
+    if not csv_path.exists():
+        return
+
+    if cache.execute("SELECT COUNT(*) FROM cache").fetchone()[0] > 0:
+        return
+
+    cols = [
+        "zip_and_municipality",
+        "latitude",
+        "longitude",
+        "altitude",
+        "geocode_source",
+    ]
+    legacy_df = pd.read_csv(csv_path, usecols=cols)[cols].dropna(
+        subset=["zip_and_municipality", "latitude", "longitude"]
+    )
+    legacy_df = legacy_df.astype(object).where(legacy_df.notna(), None)
+
+    with cache:
+        cache.executemany(
+            "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+            legacy_df.itertuples(index=False, name=None),
+        )
+
+    logger.info(f"Imported {len(legacy_df)} cached results from {csv_path}.")
+
+
+def cached_geocode(
+    text: str,
+    ratelimiter: RateLimiter,
+    cache: sqlite3.Connection,
+    lock: threading.Lock,
+) -> tuple:
+    """
+    Geocode using `safe_geocode` and store the result in the cache right away.
+
+    Parameters
+    ----------
+    text : str
+        Input text to be geocoded, typically in the format 'PLZ Ort, Deutschland'.
+    ratelimiter : geopy.extra.rate_limiter.RateLimiter
+        Configured RateLimiter instance used to throttle geocoding requests.
+    cache : sqlite3.Connection
+        Connection to the geocoding cache as returned by `geocode_cache`.
+    lock : threading.Lock
+        Lock serializing writes to the cache.
+
+    Returns
+    -------
+    tuple
+        A tuple of (Location or None, str) as returned by `safe_geocode`.
+    """
+    location, source = safe_geocode(text, ratelimiter)
+    point = tuple(location.point) if location else (None, None, None)
+
+    with lock:
+        cache.execute(
+            "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+            (text, *point, source),
+        )
+        cache.commit()
+
+    return location, source
+
+
 def geocode_data(
     geocoding_df: pd.DataFrame,
     ratelimiter: RateLimiter,
     epsg: int,
+    max_workers: int = 1,
 ) -> gpd.GeoDataFrame:
     """
     Geocode zip code and municipality.
     Extract latitude, longitude and altitude.
     Transform latitude and longitude to shapely
     Point and return a geopandas GeoDataFrame.
+
+    Requests are issued from a pool of `max_workers` threads sharing the
+    (thread-safe) RateLimiter, so network latency overlaps while the configured
+    delay between requests is still respected. Every result is written to a
+    SQLite cache as soon as it arrives, so reruns only geocode new or previously
+    failed locations, even after an interrupted run.
     """
-    cache_path = RESULTS_DIR / "geocode_results.csv"
+    cache_path = RESULTS_DIR / "geocode_cache.sqlite"
+    cache = geocode_cache(cache_path)
 
-    if cache_path.exists():
-        cached_df = pd.read_csv(cache_path)
-        cached_successful = cached_df.dropna(subset=["latitude", "longitude"])
+    try:
+        import_legacy_cache(cache, RESULTS_DIR / "geocode_results.csv")
+
+        cached_successful = pd.read_sql_query(
+            "SELECT key AS zip_and_municipality, source AS geocode_source, "
+            "lat AS latitude, lon AS longitude, alt AS altitude FROM cache "
+            "WHERE lat IS NOT NULL AND lon IS NOT NULL",
+            cache,
+            dtype={
+                "latitude": "float64",
+                "longitude": "float64",
+                "altitude": "float64",
+            },
+        )
         logger.info(
             f"Loaded {len(cached_successful)} successful cached results from "
             f"{cache_path}"
         )
-    else:
-        cached_successful = pd.DataFrame(columns=["zip_and_municipality"])
 
-    to_geocode_df = geocoding_df[
-        ~geocoding_df.zip_and_municipality.isin(cached_successful.zip_and_municipality)
-    ].copy()
+        to_geocode_df = geocoding_df[
+            ~geocoding_df.zip_and_municipality.isin(
+                cached_successful.zip_and_municipality
+            )
+        ].copy()
+
+        if not to_geocode_df.empty:
+            logger.info(
+                f"Geocoding {len(to_geocode_df)} of {len(geocoding_df)} locations ..."
+            )
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(
+                    executor.map(
+                        partial(
+                            cached_geocode,
+                            ratelimiter=ratelimiter,
+                            cache=cache,
+                            lock=threading.Lock(),
+                        ),
+                        to_geocode_df.zip_and_municipality,
+                    )
+                )
+    finally:
+        cache.close()
 
     if to_geocode_df.empty:
         logger.info("No new locations to geocode. Using cached results only.")
         final_df = cached_successful
     else:
-        logger.info(
-            f"Geocoding {len(to_geocode_df)} of {len(geocoding_df)} locations ..."
-        )
-
-        new_df = pd.DataFrame()
-
-        new_df[
-            ["location", "geocode_source"]
-        ] = to_geocode_df.zip_and_municipality.apply(
-            lambda x: pd.Series(safe_geocode(x, ratelimiter))
+        new_df = pd.DataFrame(
+            results,
+            index=to_geocode_df.index,
+            columns=["location", "geocode_source"],
         )
 
-        new_df = new_df.assign(
-            point=new_df.location.apply(lambda loc: tuple(loc.point) if loc else None)
-        )
+        locations = new_df.location.to_numpy()
 
-        new_df[["latitude", "longitude", "altitude"]] = pd.DataFrame(
-            new_df.point.tolist(), index=new_df.index
-        )
+        for col in ["latitude", "longitude", "altitude"]:
+            new_df[col] = np.fromiter(
+                (getattr(loc, col) if loc else np.nan for loc in locations),
+                dtype="float64",
+                count=len(locations),
+            )
 
         new_df["zip_and_municipality"] = to_geocode_df.zip_and_municipality.values
 
-        final_df = pd.concat([cached_successful, new_df], ignore_index=True)
-
-        # Speichere vollständige aktualisierte Ergebnisse
-        final_df.to_csv(cache_path, index=False)
-        logger.info(f"Updated geocode results saved to {cache_path}")
+        final_df = pd.concat(
+            [cached_successful, new_df.drop(columns=["location"])],
+            ignore_index=True,
+        )
 
         # Speichere fehlgeschlagene
         failed = new_df.loc[new_df.latitude.isna() | new_df.longitude.isna()]
@@ -189,7 +333,10 @@ def geocode_data(
 
     return gpd.GeoDataFrame(
         final_df,
-        geometry=gpd.points_from_xy(final_df.longitude, final_df.latitude),
+        geometry=shapely.points(
+            final_df.longitude.to_numpy("float64"),
+            final_df.latitude.to_numpy("float64"),
+        ),
         crs=f"EPSG:{epsg}",  # noqa: E231
     )
 
@@ -198,25 +345,29 @@ def run_mastr_geocoding() -> None:
     """
     Main run function.
     """
+    mastr_data = settings["mastr-data"]
+    geocoding = settings["geocoding"]
+
     download_mastr_data()
 
     geocoding_df = get_zip_and_municipality()
 
     ratelimiter = geocoder(
-        settings["geocoding"].user_agent,
-        settings["geocoding"].min_delay_seconds,
-        settings["geocoding"].max_retries,
-        settings["geocoding"].error_wait_seconds,
+        geocoding.user_agent,
+        geocoding.min_delay_seconds,
+        geocoding.max_retries,
+        geocoding.error_wait_seconds,
     )
 
     geocoded_gdf = geocode_data(
-        geocoding_df, ratelimiter, epsg=settings["mastr-data"].epsg
+        geocoding_df,
+        ratelimiter,
+        epsg=mastr_data.epsg,
+        max_workers=geocoding.max_workers,
     )
 
-    geocoded_gdf.drop(columns=["location", "point"]).to_file(
+    geocoded_gdf.to_file(
         RESULTS_DIR
-        / settings["geocoding"].export_f.format(
-            MASTR_DATA_DIR.parts[-1], settings["mastr-data"].deposit_id
-        ),
+        / geocoding.export_f.format(MASTR_DATA_DIR.parts[-1], mastr_data.deposit_id),
         driver="GPKG",
     )